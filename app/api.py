@@ -5,23 +5,37 @@ API interaction functions.
 import requests
 from app.config import GAMMA_API_URL, HEADERS
 
+def fetch_active_markets(tag_slug, limit=100, max_pages=10):
+    """
+    Fetch active events for a tag from Gamma API, following pagination.
+    """
+    events = []
+    print(f"📡 Запит до Polymarket API (tag: {tag_slug})...")
+    for page in range(max_pages):
+        params = {
+            "limit": limit,
+            "offset": page * limit,
+            "active": "true",
+            "closed": "false",
+            "tag_slug": tag_slug,
+            "order": "endDate",
+            "ascending": "true"
+        }
+        try:
+            r = requests.get(GAMMA_API_URL, params=params, headers=HEADERS, timeout=10)
+            r.raise_for_status()
+            batch = r.json()
+        except Exception as e:
+            print(f"❌ Помилка: {e}")
+            break
+
+        events.extend(batch)
+        if len(batch) < limit:
+            break
+    return events
+
 def fetch_active_bitcoin_markets():
     """
     Fetch active Bitcoin markets from Gamma API.
     """
-    params = {
-        "limit": 100,
-        "active": "true",
-        "closed": "false",
-        "tag_slug": "bitcoin",
-        "order": "endDate",
-        "ascending": "true"
-    }
-    try:
-        print(f"📡 Запит до Polymarket API...")
-        r = requests.get(GAMMA_API_URL, params=params, headers=HEADERS, timeout=10)
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        print(f"❌ Помилка: {e}")
-        return []
+    return fetch_active_markets("bitcoin")
@@ -14,3 +14,80 @@ HEADERS = {
 
 # Time to prefetch next market (seconds)
 PREFETCH_TIME = 30
+
+# Slug regexes of recurring timeframes, checked before keywords.
+# Daily Up/Down slugs look like 'bitcoin-up-or-down-on-october-19'.
+TIMEFRAME_SLUG_PATTERNS = {
+    "1d": [r"-on-[a-z]+-\d{1,2}(-|$)"],
+}
+
+# Supported recurring timeframes and the slug/title keywords that identify them.
+# Events matching none of these (and not long-term) are treated as 1h markets.
+TIMEFRAME_KEYWORDS = {
+    "15m": ["15m", "15 min"],
+    "4h": ["4h", "4 hour"],
+    "1d": ["daily"],
+}
+
+# Keywords of long-term markets that are never recorded
+LONG_TERM_KEYWORDS = ["weekly", "month", "year", "quarterly"]
+
+# Market selection specs. Each spec describes one group of recurring markets:
+# - name: prefix for folder/file names (market_<name>_<timeframe>)
+# - tags: Gamma tag slugs to query
+# - slug_patterns: fnmatch patterns for event slugs (empty list = any slug)
+# - timeframes: timeframes to record
+# - horizon_minutes (optional): record every matching event ending within
+#   this horizon instead of only the current round
+MARKET_SPECS = [
+    {
+        "name": "btc",
+        "tags": ["bitcoin"],
+        "slug_patterns": ["*updown*", "*up-or-down*"],
+        "timeframes": ["15m", "1h", "4h"],
+    },
+    {
+        "name": "eth",
+        "tags": ["ethereum"],
+        "slug_patterns": ["*updown*", "*up-or-down*"],
+        "timeframes": ["15m", "1h", "4h"],
+    },
+    {
+        "name": "sol",
+        "tags": ["solana"],
+        "slug_patterns": ["*updown*", "*up-or-down*"],
+        "timeframes": ["15m", "1h", "4h"],
+    },
+    {
+        "name": "xrp",
+        "tags": ["xrp"],
+        "slug_patterns": ["*updown*", "*up-or-down*"],
+        "timeframes": ["15m", "1h", "4h"],
+    },
+]
+
+# Number of worker processes that record markets
+WORKER_PROCESSES = 4
+
+# Max interval between market list refreshes in the supervisor (seconds)
+REFRESH_INTERVAL = 10
+
+# Interval between runtime state checkpoints (seconds)
+CHECKPOINT_INTERVAL = 5
+
+# Trades fetched on warm restart to backfill the missed window
+BACKFILL_TRADES_LIMIT = 500
+
+# Derived feature stage (sidecar features_<label>.csv per market)
+FEATURES_ENABLED = False
+
+# Rolling window for trade VWAP and volume features (seconds)
+FEATURE_WINDOW = 60
+
+# Duration of each timeframe, used to find the market open time (seconds)
+TIMEFRAME_SECONDS = {
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "4h": 4 * 60 * 60,
+    "1d": 24 * 60 * 60,
+}
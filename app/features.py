@@ -0,0 +1,228 @@
+"""
+Derived per-tick features computed from the recorded order books and trades.
+"""
+
+import csv
+import os
+from collections import deque
+
+class RollingWindow:
+    """
+    Sum of values over the last `size` seconds.
+    Backed by a ring buffer of per-second buckets, so advancing by one tick is O(1).
+    """
+    def __init__(self, size):
+        self.size = size
+        self.buckets = [0.0] * size
+        self.total = 0.0
+        self.last_second = None
+
+    def _advance(self, second):
+        if self.last_second is None:
+            self.last_second = second
+            return
+        steps = second - self.last_second
+        if steps <= 0:
+            return
+        if steps >= self.size:
+            self.buckets = [0.0] * self.size
+            self.total = 0.0
+        else:
+            for s in range(self.last_second + 1, second + 1):
+                idx = s % self.size
+                self.total -= self.buckets[idx]
+                self.buckets[idx] = 0.0
+                if idx == 0:
+                    # Recompute once per wrap to drop accumulated float error
+                    self.total = sum(self.buckets)
+        self.last_second = second
+
+    def add(self, second, value):
+        self._advance(second)
+        if second <= self.last_second - self.size:
+            return
+        self.buckets[second % self.size] += value
+        self.total += value
+
+    def value(self, second):
+        self._advance(second)
+        return self.total
+
+
+def _levels(book_row, offset):
+    """
+    Returns [(price, size), ...] for 5 levels of a parse_book row, skipping empty ones.
+    """
+    levels = []
+    for i in range(5):
+        price = book_row[offset + 2 * i]
+        size = book_row[offset + 2 * i + 1]
+        if price == "" or size == "":
+            break
+        levels.append((float(price), float(size)))
+    return levels
+
+def book_features(book_row):
+    """
+    Mid, spread, microprice and top-5 depth imbalance from a parse_book row.
+    Missing values are None.
+    """
+    bids = _levels(book_row, 0)
+    asks = _levels(book_row, 10)
+
+    mid = spread = microprice = imbalance = None
+    if bids and asks:
+        (bid, bid_size), (ask, ask_size) = bids[0], asks[0]
+        mid = (bid + ask) / 2
+        spread = ask - bid
+        if bid_size + ask_size > 0:
+            microprice = (bid * ask_size + ask * bid_size) / (bid_size + ask_size)
+
+    bid_depth = sum(s for _, s in bids)
+    ask_depth = sum(s for _, s in asks)
+    if bid_depth + ask_depth > 0:
+        imbalance = (bid_depth - ask_depth) / (bid_depth + ask_depth)
+
+    return mid, spread, microprice, imbalance
+
+
+def _trade_key(t):
+    return (t.get('transactionHash'), t.get('asset'), t.get('side'), t.get('price'),
+            t.get('size'), t.get('timestamp'), t.get('proxyWallet'))
+
+class TradeWindow:
+    """
+    Rolling VWAP and volume of one token's trades.
+    Consecutive fetches overlap and trade timestamps are whole seconds, so a
+    time cutoff cannot tell new trades from already counted ones. Instead the
+    window remembers the trades it has added and counts each one exactly once.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.volume = RollingWindow(size)
+        self.notional = RollingWindow(size)
+        self.seen = set()
+        self.seen_order = deque()
+
+    def add_trades(self, trades_data, token_id):
+        for t in trades_data or []:
+            if t.get('asset') != token_id:
+                continue
+            key = _trade_key(t)
+            if key in self.seen:
+                continue
+            try:
+                second = int(float(t.get('timestamp', 0)))
+                price = float(t.get('price'))
+                size = float(t.get('size', 0))
+            except:
+                continue
+            self.seen.add(key)
+            self.seen_order.append((second, key))
+            self.volume.add(second, size)
+            self.notional.add(second, price * size)
+
+    def _forget(self, second):
+        # Trades older than the window can no longer affect it
+        while self.seen_order and self.seen_order[0][0] <= second - self.size:
+            self.seen.discard(self.seen_order.popleft()[1])
+
+    def value(self, second):
+        self._forget(second)
+        volume = self.volume.value(second)
+        notional = self.notional.value(second)
+        vwap = notional / volume if volume > 0 else None
+        return vwap, volume
+
+
+def _fmt(value):
+    return "" if value is None else round(value, 6)
+
+class FeatureStage:
+    """
+    Computes derived features of one market once per tick and writes them
+    to a sidecar CSV next to the market file and to any extra outputs
+    (callables receiving the feature dict).
+    """
+    def __init__(self, yes_id, no_id, window=60, outputs=None):
+        self.file_path = None
+        self.yes_id = yes_id
+        self.no_id = no_id
+        self.window = window
+        self.yes_trades = TradeWindow(window)
+        self.no_trades = TradeWindow(window)
+        self.outputs = outputs or []
+
+    def columns(self):
+        w = self.window
+        cols = ["Timestamp_UTC"]
+        for side in ("YES", "NO"):
+            cols.extend([f"{side}_Mid", f"{side}_Spread", f"{side}_Microprice", f"{side}_Depth_Imbalance"])
+        cols.append("Parity_Gap")
+        for side in ("YES", "NO"):
+            cols.extend([f"{side}_VWAP_{w}s", f"{side}_Volume_{w}s"])
+        cols.extend(["BTC_Price", "BTC_Return_Since_Open"])
+        return cols
+
+    def init_file(self, folder_path, market_info, label):
+        """
+        Creates the sidecar feature file, or reuses it if it already belongs
+        to the same market (e.g. after a warm restart). Features are derived
+        data, so a file of another market is overwritten.
+        """
+        full_path = os.path.join(folder_path, f"features_{label}.csv")
+        self.file_path = full_path
+
+        if os.path.exists(full_path):
+            try:
+                with open(full_path, 'r') as f:
+                    for _ in range(5):
+                        parts = f.readline().strip().split(',')
+                        if parts[0] == "Market ID":
+                            if len(parts) > 1 and parts[1] == str(market_info['market_id']):
+                                return full_path
+                            break
+            except Exception as e:
+                print(f"⚠️  [{label}] Помилка при перевірці файлу ознак: {e}")
+
+        with open(full_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["# METADATA_START"])
+            writer.writerow(["Market ID", market_info['market_id']])
+            writer.writerow(["Timeframe", market_info.get('timeframe', label)])
+            writer.writerow(["Rolling Window (s)", self.window])
+            writer.writerow(["# METADATA_END"])
+            writer.writerow(self.columns())
+
+        return full_path
+
+    def update(self, timestamp, now_ts, yes_book_row, no_book_row, trades_data,
+               btc_price=None, btc_open_price=None):
+        """
+        Processes one tick and returns the feature dict.
+        """
+        self.yes_trades.add_trades(trades_data, self.yes_id)
+        self.no_trades.add_trades(trades_data, self.no_id)
+
+        yes = book_features(yes_book_row)
+        no = book_features(no_book_row)
+        parity_gap = yes[0] + no[0] - 1 if yes[0] is not None and no[0] is not None else None
+
+        second = int(now_ts)
+        yes_vwap, yes_volume = self.yes_trades.value(second)
+        no_vwap, no_volume = self.no_trades.value(second)
+
+        btc_return = None
+        if btc_price is not None and btc_open_price:
+            btc_return = btc_price / btc_open_price - 1
+
+        values = [timestamp] + [_fmt(v) for v in yes + no] + [_fmt(parity_gap)] + \
+                 [_fmt(yes_vwap), _fmt(yes_volume), _fmt(no_vwap), _fmt(no_volume),
+                  _fmt(btc_price), _fmt(btc_return)]
+        features = dict(zip(self.columns(), values))
+
+        with open(self.file_path, 'a', newline='') as f:
+            csv.writer(f).writerow(values)
+        for output in self.outputs:
+            output(features)
+        return features
@@ -2,11 +2,14 @@
 Market finding and data extraction logic.
 """
 
+import re
 import json
+from fnmatch import fnmatch
 from datetime import datetime, timedelta, timezone
 from dateutil import parser
 
-from app.api import fetch_active_bitcoin_markets
+from app.api import fetch_active_bitcoin_markets, fetch_active_markets
+from app.config import MARKET_SPECS, TIMEFRAME_SLUG_PATTERNS, TIMEFRAME_KEYWORDS, LONG_TERM_KEYWORDS
 from app.utils import get_target_time_h1
 
 def find_markets():
@@ -125,13 +128,7 @@ def find_next_market(current_end_time, is_m15=False):
     print(f"⚠️  Наступний ринок не знайдено")
     return None
 
-def extract_ids(market_event):
-    """
-    Extracts relevant IDs and info from a market event.
-    """
-    if not market_event or not market_event.get('markets'): return None
-    md = market_event['markets'][0]
-    
+def _market_ids(market_event, md):
     clob_token_ids = md.get('clobTokenIds', '[]')
     if isinstance(clob_token_ids, str):
         try:
@@ -141,6 +138,7 @@ def extract_ids(market_event):
     
     return {
         "title": market_event.get('title'),
+        "question": md.get('question'),
         "start_date": market_event.get('startDate'),
         "end_date": market_event.get('endDate'),
         "market_id": md.get('id'),
@@ -149,3 +147,153 @@ def extract_ids(market_event):
         "yes_id": clob_token_ids[0] if len(clob_token_ids) > 0 else "N/A",
         "no_id": clob_token_ids[1] if len(clob_token_ids) > 1 else "N/A"
     }
+
+def extract_ids(market_event):
+    """
+    Extracts relevant IDs and info from a market event (its first market).
+    """
+    if not market_event or not market_event.get('markets'): return None
+    return _market_ids(market_event, market_event['markets'][0])
+
+def extract_all_ids(market_event):
+    """
+    Extracts IDs and info for every open market of an event
+    (e.g. all strikes of a ladder event).
+    """
+    if not market_event or not market_event.get('markets'): return []
+    return [_market_ids(market_event, md) for md in market_event['markets'] if not md.get('closed')]
+
+
+# Timeframes classify_timeframe can return
+KNOWN_TIMEFRAMES = set(TIMEFRAME_SLUG_PATTERNS) | set(TIMEFRAME_KEYWORDS) | {"1h"}
+
+def classify_timeframe(event):
+    """
+    Returns the timeframe of a recurring market event ('15m', '1h', ...)
+    or None for long-term markets.
+    """
+    title = (event.get('title') or '').lower()
+    slug = (event.get('slug') or '').lower()
+
+    for timeframe, patterns in TIMEFRAME_SLUG_PATTERNS.items():
+        if any(re.search(p, slug) for p in patterns):
+            return timeframe
+
+    for timeframe, keywords in TIMEFRAME_KEYWORDS.items():
+        if any(kw in slug or kw in title for kw in keywords):
+            return timeframe
+
+    if any(kw in slug or kw in title for kw in LONG_TERM_KEYWORDS):
+        return None
+    return "1h"
+
+def load_market_specs(path=None):
+    """
+    Loads market selection specs from a JSON file (or the defaults from config)
+    and validates them.
+    """
+    if path:
+        with open(path, 'r') as f:
+            specs = json.load(f)
+    else:
+        specs = MARKET_SPECS
+
+    names = set()
+    for spec in specs:
+        name = spec.get('name')
+        if not name:
+            raise ValueError(f"Spec without name: {spec}")
+        if name in names:
+            raise ValueError(f"Duplicate spec name: {name}")
+        tags = spec.get('tags')
+        if not isinstance(tags, list) or not tags or not all(isinstance(t, str) for t in tags):
+            raise ValueError(f"Spec '{name}': tags must be a non-empty list of strings")
+        timeframes = spec.get('timeframes')
+        if not isinstance(timeframes, list) or not timeframes:
+            raise ValueError(f"Spec '{name}': timeframes must be a non-empty list")
+        unknown = [tf for tf in timeframes if tf not in KNOWN_TIMEFRAMES]
+        if unknown:
+            raise ValueError(f"Spec '{name}': unknown timeframes {unknown}, expected {sorted(KNOWN_TIMEFRAMES)}")
+        if not isinstance(spec.get('slug_patterns', []), list):
+            raise ValueError(f"Spec '{name}': slug_patterns must be a list")
+        horizon = spec.get('horizon_minutes')
+        if horizon is not None and (not isinstance(horizon, (int, float)) or horizon <= 0):
+            raise ValueError(f"Spec '{name}': horizon_minutes must be a positive number")
+        names.add(name)
+    return specs
+
+def select_markets(specs):
+    """
+    Selects markets to record for every (spec, timeframe) pair.
+
+    By default this is the current round: all events sharing the nearest end
+    time. With 'horizon_minutes' in the spec, every matching event that ends
+    within the horizon is selected. All open markets of each event are recorded.
+
+    Args:
+        specs: list of market selection specs (see MARKET_SPECS)
+
+    Returns:
+        dict {label: market info}. The label is '<spec name>_<timeframe>' when
+        the pair yields a single market, otherwise '<spec name>_<timeframe>_<market id>'.
+    """
+    now = datetime.now(timezone.utc)
+
+    # Each tag is fetched once even if several specs use it
+    events_by_tag = {}
+    for spec in specs:
+        for tag in spec['tags']:
+            if tag not in events_by_tag:
+                events_by_tag[tag] = fetch_active_markets(tag)
+
+    selected = {}
+    for spec in specs:
+        patterns = spec.get('slug_patterns') or []
+        horizon = spec.get('horizon_minutes')
+        candidates = {}
+        seen = set()
+
+        for tag in spec['tags']:
+            for event in events_by_tag[tag]:
+                event_key = event.get('id') or event.get('slug')
+                if event_key in seen: continue
+                if 'endDate' not in event: continue
+                try:
+                    end_date = parser.isoparse(event['endDate'])
+                except: continue
+
+                if end_date <= now:
+                    continue
+                if horizon and end_date > now + timedelta(minutes=horizon):
+                    continue
+
+                slug = (event.get('slug') or '').lower()
+                if patterns and not any(fnmatch(slug, p) for p in patterns):
+                    continue
+
+                timeframe = classify_timeframe(event)
+                if timeframe not in spec['timeframes']:
+                    continue
+
+                seen.add(event_key)
+                candidates.setdefault(timeframe, []).append((end_date, event))
+
+        for timeframe, events in candidates.items():
+            if not horizon:
+                nearest = min(end_date for end_date, _ in events)
+                events = [(end_date, event) for end_date, event in events if end_date == nearest]
+
+            infos = []
+            for _, event in events:
+                for info in extract_all_ids(event):
+                    if info['yes_id'] == "N/A" or info['no_id'] == "N/A":
+                        continue
+                    info['timeframe'] = timeframe
+                    infos.append(info)
+
+            base_label = f"{spec['name']}_{timeframe}"
+            for info in infos:
+                label = base_label if len(infos) == 1 else f"{base_label}_{info['market_id']}"
+                selected[label] = info
+
+    return selected
@@ -4,7 +4,11 @@ import csv
 import os
 import sys
 import json
+import queue
+import signal
+import argparse
 import concurrent.futures
+import multiprocessing
 import requests
 import threading
 from datetime import datetime, timezone, timedelta
@@ -12,60 +16,127 @@ from datetime import datetime, timezone, timedelta
 # Додаємо поточну директорію в path
 sys.path.append(os.getcwd())
 
-from fetch_markets import find_nearest_markets, extract_ids
+from app.config import WORKER_PROCESSES, REFRESH_INTERVAL, CHECKPOINT_INTERVAL, BACKFILL_TRADES_LIMIT, \
+    FEATURES_ENABLED, FEATURE_WINDOW, TIMEFRAME_SECONDS
+from app.market import load_market_specs, select_markets
+from app.features import FeatureStage
 
 # Базова папка для збереження даних
 BASE_DATA_DIR = "data_monitor"
 
+# Файл зі збереженим станом для теплого рестарту
+STATE_FILE = os.path.join(BASE_DATA_DIR, "runtime_state.json")
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Скільки тіків повторювати дозапис після рестарту при порожній відповіді з угодами
+BACKFILL_ATTEMPTS = 3
+
+# Скільки тіків максимум чекати на дозапис; поки він не виконаний,
+# нові рядки буферизуються в пам'яті, щоб файл лишався впорядкованим за часом
+BACKFILL_MAX_TICKS = 30
+
+# Простій (с), за який порожня відповідь з угодами вважається підозрілою
+BACKFILL_EMPTY_GAP = 2.0
+
+# Через скільки секунд після закриття ринку без "done" його мітка звільняється
+ASSIGNMENT_GRACE = 60
+
+# Скільки чекати завершення потоків ринків при зупинці воркера (с)
+WORKER_STOP_TIMEOUT = 5
+
+# Воркери створюються через spawn: fork з процесу, де вже працюють потоки
+# (BTC, супервізор), може успадкувати захоплений lock і зависнути
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
 class SessionManager:
     def __init__(self):
         self.lock = threading.Lock()
         self.current_session_dir = None
         self.current_session_end_dt = None
         
-    def get_session_dir(self, market_end_dt):
+    def get_session_dir(self, now_dt):
         """
-        Повертає шлях до папки сесії для заданого часу закінчення ринку.
-        Якщо час виходить за межі поточної сесії, створює нову.
+        Повертає шлях до поточної сесії для моменту now_dt (потік BTC).
+        Лише цей виклик зсуває поточну сесію вперед.
         """
+        session_end = self._session_end(now_dt)
         with self.lock:
-            if self.current_session_dir is None:
-                self._create_new_session(market_end_dt)
-                return self.current_session_dir
+            if self.current_session_dir is None or session_end > self.current_session_end_dt:
+                if self.current_session_dir is not None:
+                    print(f"🔄 [Session] Час {now_dt} виходить за межі сесії {self.current_session_end_dt}. Створення нової...")
+                self._create_new_session(session_end)
+            return self.current_session_dir
             
-            if market_end_dt <= self.current_session_end_dt + timedelta(minutes=1):
-                return self.current_session_dir
+    def session_dir_for(self, market_end_dt):
+        """
+        Повертає папку сесії для ринку за часом його закінчення, не змінюючи
+        поточну сесію: ринки наступної сесії (напр. з horizon_minutes) не
+        переносять туди BTC і ринки поточного раунду.
+        Ринки, довші за сесію (напр. 1d), пишуться в поточну сесію.
+        """
+        now = datetime.now(timezone.utc)
+        if market_end_dt - now > timedelta(hours=4):
+            return self.get_session_dir(now)
             
-            print(f"🔄 [Session] Час ринку {market_end_dt} виходить за межі сесії {self.current_session_end_dt}. Створення нової...")
-            self._create_new_session(market_end_dt)
-            return self.current_session_dir
+        session_dir = self._session_path(self._session_end(market_end_dt))
+        os.makedirs(session_dir, exist_ok=True)
+        return session_dir
+        
+    def to_state(self):
+        with self.lock:
+            if self.current_session_dir is None:
+                return None
+            return {
+                "dir": self.current_session_dir,
+                "end_dt": self.current_session_end_dt.isoformat()
+            }
             
-    def _create_new_session(self, target_dt):
+    def restore(self, state):
         """
-        Створює нову структуру папок на основі 4-годинних інтервалів.
+        Відновлює поточну сесію зі збереженого стану.
         """
-        base_time = target_dt.replace(minute=0, second=0, microsecond=0)
-        remainder = base_time.hour % 4
-        hours_to_add = 4 - remainder
-        if hours_to_add == 0 and target_dt.minute == 0:
-             session_end = target_dt
-        else:
-            session_end = base_time + timedelta(hours=hours_to_add)
+        session_dir = state['dir']
+        session_end_dt = datetime.fromisoformat(state['end_dt'])
+        if session_end_dt.tzinfo is None:
+            raise ValueError(f"end_dt без часової зони: {state['end_dt']}")
+        os.makedirs(session_dir, exist_ok=True)
+        with self.lock:
+            self.current_session_dir = session_dir
+            self.current_session_end_dt = session_end_dt
+        print(f"📂 [Session] Відновлено сесію: {self.current_session_dir}")
             
-        self.current_session_end_dt = session_end
+    @staticmethod
+    def _session_end(dt):
+        """
+        Кінець 4-годинної сесії, що містить dt. Хвилина після межі ще належить
+        сесії, що закінчилась (ринки закриваються рівно на межі).
+        """
+        t = dt - timedelta(minutes=1)
+        base_time = t.replace(minute=0, second=0, microsecond=0)
+        if t == base_time and base_time.hour % 4 == 0:
+            return base_time
+        return base_time + timedelta(hours=4 - base_time.hour % 4)
         
+    @staticmethod
+    def _session_path(session_end):
         date_str = session_end.strftime('%Y%m%d_%H%M')
-        session_name = f"session_4h_close_{date_str}"
-        self.current_session_dir = os.path.join(BASE_DATA_DIR, session_name)
+        return os.path.join(BASE_DATA_DIR, f"session_4h_close_{date_str}")
         
-        os.makedirs(os.path.join(self.current_session_dir, "market_4h"), exist_ok=True)
-        os.makedirs(os.path.join(self.current_session_dir, "market_1h"), exist_ok=True)
-        os.makedirs(os.path.join(self.current_session_dir, "market_15m"), exist_ok=True)
+    def _create_new_session(self, session_end):
+        """
+        Створює нову поточну сесію. Папки окремих ринків створюються при старті їх моніторингу.
+        """
+        self.current_session_end_dt = session_end
+        self.current_session_dir = self._session_path(session_end)
+        
+        os.makedirs(self.current_session_dir, exist_ok=True)
         
-        print(f"📂 [Session] Нова сесія: {session_name} (End: {session_end})")
+        print(f"📂 [Session] Нова сесія: {os.path.basename(self.current_session_dir)} (End: {session_end})")
 
 
-# Глобальний менеджер сесій
+# Глобальний менеджер сесій. Живе лише в процесі супервізора: воркери
+# отримують готовий шлях до сесії разом із завданням.
 session_manager = SessionManager()
 
 
@@ -80,6 +151,89 @@ def fetch_btc_price():
         pass
     return None
 
+def fetch_btc_open_price(open_ts):
+    """
+    Ціна відкриття BTC на хвилинній свічці, що містить open_ts.
+    """
+    url = "https://api.binance.com/api/v3/klines"
+    params = {"symbol": "BTCUSDT", "interval": "1m", "startTime": int(open_ts // 60 * 60 * 1000), "limit": 1}
+    try:
+        r = requests.get(url, params=params, timeout=2)
+        if r.status_code == 200:
+            data = r.json()
+            if data:
+                return float(data[0][1])
+    except:
+        pass
+    return None
+
+class BtcPriceFeed:
+    """
+    Остання ціна BTC в процесі воркера для стадії ознак:
+    один запит на секунду на процес, а не на кожен ринок.
+    Ціни відкриття ринків теж запитуються у фоновому потоці,
+    тік ринку лише читає кеш.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.price = None
+        self.thread = None
+        self.open_prices = {}
+        self.open_attempts = {}
+        
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+                
+    def _loop(self):
+        while True:
+            loop_start = time.time()
+            price = fetch_btc_price()
+            if price:
+                self.price = float(price)
+            self._fetch_open_prices(loop_start)
+            elapsed = time.time() - loop_start
+            time.sleep(max(0, 1.0 - elapsed))
+            
+    def _fetch_open_prices(self, now_ts):
+        """
+        Запитує ціни відкриття, яких ще немає в кеші. Після невдалої спроби
+        повторює не частіше ніж раз на 10 секунд. Записи старші за 2 доби видаляються.
+        """
+        with self.lock:
+            for open_ts in [ts for ts in self.open_attempts if ts < now_ts - 2 * 86400]:
+                self.open_attempts.pop(open_ts, None)
+                self.open_prices.pop(open_ts, None)
+            pending = [ts for ts, attempt in self.open_attempts.items()
+                       if ts not in self.open_prices and ts <= now_ts and now_ts - attempt >= 10]
+            
+        for open_ts in pending:
+            price = fetch_btc_open_price(open_ts)
+            with self.lock:
+                self.open_attempts[open_ts] = time.time()
+                if price:
+                    self.open_prices[open_ts] = price
+                    
+    def latest(self):
+        return self.price
+        
+    def open_price(self, open_ts):
+        """
+        Кешована ціна BTC на момент відкриття ринку або None, поки її не отримано.
+        Не блокує: запит виконує фоновий потік.
+        """
+        with self.lock:
+            if open_ts not in self.open_attempts:
+                self.open_attempts[open_ts] = 0
+            return self.open_prices.get(open_ts)
+
+
+# Ціна BTC для ознак; потік запускається лише якщо стадія ознак увімкнена
+btc_feed = BtcPriceFeed()
+
+
 def fetch_orderbook(token_id):
     url = f"https://clob.polymarket.com/book?token_id={token_id}"
     try:
@@ -117,15 +271,18 @@ def parse_book(book_data):
             row.append("")
     return row
 
-def fetch_trades(condition_id):
-    url = f"https://data-api.polymarket.com/trades?market={condition_id}&limit=50"
+def fetch_trades(condition_id, limit=50):
+    """
+    Останні угоди ринку. None, якщо запит не вдався (на відміну від порожньої відповіді).
+    """
+    url = f"https://data-api.polymarket.com/trades?market={condition_id}&limit={limit}"
     try:
         r = requests.get(url, timeout=2)
         if r.status_code == 200:
             return r.json()
     except:
         pass
-    return []
+    return None
 
 def parse_trades(trades_data, token_id, last_check_time):
     if not trades_data:
@@ -159,8 +316,67 @@ def parse_trades(trades_data, token_id, last_check_time):
     trades_str = "|".join(trades_list)
     return last_price, volume_1s, trades_str
 
-def init_market_file(folder_path, market_info, timeframe):
-    filename = f"market_{timeframe}.csv"
+def backfill_rows(trades_data, yes_id, no_id, since, until):
+    """
+    Рядки для угод з вікна (since, until], пропущеного під час рестарту:
+    по рядку на кожну секунду, в яку були угоди. Стакан за ці секунди
+    невідомий, тому його колонки порожні.
+    Повертає (rows, complete).
+    """
+    buckets = {}
+    oldest = None
+    for t in trades_data or []:
+        try:
+            ts = float(t.get('timestamp', 0))
+        except:
+            continue
+        oldest = ts if oldest is None else min(oldest, ts)
+        if since < ts <= until:
+            buckets.setdefault(int(ts), []).append(t)
+            
+    rows = []
+    for second in sorted(buckets):
+        bucket = buckets[second]
+        yes_last, yes_vol, yes_str = parse_trades(bucket, yes_id, second - 1)
+        no_last, no_vol, no_str = parse_trades(bucket, no_id, second - 1)
+        timestamp = datetime.fromtimestamp(second, timezone.utc).strftime(TIMESTAMP_FORMAT)[:-3]
+        rows.append([timestamp, yes_last, yes_vol, yes_str] + parse_book(None) + \
+                    [no_last, no_vol, no_str] + parse_book(None))
+        
+    if oldest is None:
+        # Порожня відповідь при помітному простої - можливо, угоди втрачено
+        complete = until - since <= BACKFILL_EMPTY_GAP
+    else:
+        # Якщо найстаріша отримана угода новіша за since, частина вікна могла не влізти в ліміт
+        complete = oldest <= since or len(trades_data) < BACKFILL_TRADES_LIMIT
+    return rows, complete
+
+def read_last_timestamp(file_path):
+    """
+    Повертає час (epoch) останнього записаного рядка файлу ринку або None.
+    Читається лише хвіст файлу.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 4096))
+            lines = f.read().decode('utf-8', errors='ignore').splitlines()
+    except OSError:
+        return None
+        
+    for line in reversed(lines):
+        if not line.strip():
+            continue
+        try:
+            dt = datetime.strptime(line.split(',', 1)[0], TIMESTAMP_FORMAT)
+            return dt.replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            return None
+    return None
+
+def init_market_file(folder_path, market_info, label):
+    filename = f"market_{label}.csv"
     full_path = os.path.join(folder_path, filename)
     
     if os.path.exists(full_path):
@@ -178,15 +394,15 @@ def init_market_file(folder_path, market_info, timeframe):
             if existing_id and str(existing_id) == str(market_info['market_id']):
                 return full_path
             else:
-                archive_name = f"market_{timeframe}_{existing_id if existing_id else 'old'}_{int(time.time())}.csv"
+                archive_name = f"market_{label}_{existing_id if existing_id else 'old'}_{int(time.time())}.csv"
                 archive_path = os.path.join(folder_path, archive_name)
                 os.rename(full_path, archive_path)
-                print(f"📦 [{timeframe}] Архівовано старий файл: {archive_name}")
+                print(f"📦 [{label}] Архівовано старий файл: {archive_name}")
                 
         except Exception as e:
-            print(f"⚠️  [{timeframe}] Помилка при перевірці файлу: {e}")
+            print(f"⚠️  [{label}] Помилка при перевірці файлу: {e}")
             try:
-                backup_name = f"market_{timeframe}_backup_{int(time.time())}.csv"
+                backup_name = f"market_{label}_backup_{int(time.time())}.csv"
                 os.rename(full_path, os.path.join(folder_path, backup_name))
             except:
                 pass
@@ -196,7 +412,7 @@ def init_market_file(folder_path, market_info, timeframe):
         writer.writerow(["# METADATA_START"])
         writer.writerow(["Market Title", market_info['title']])
         writer.writerow(["Market ID", market_info['market_id']])
-        writer.writerow(["Timeframe", timeframe])
+        writer.writerow(["Timeframe", market_info.get('timeframe', label)])
         writer.writerow(["YES Token ID", market_info['yes_id']])
         writer.writerow(["NO Token ID", market_info['no_id']])
         writer.writerow(["Start Time (UTC)", datetime.now(timezone.utc).isoformat()])
@@ -236,7 +452,7 @@ def monitor_btc():
     
     while True:
         loop_start = time.time()
-        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+        timestamp = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)[:-3]
         
         new_session_dir = session_manager.get_session_dir(datetime.now(timezone.utc))
         
@@ -253,26 +469,78 @@ def monitor_btc():
         elapsed = time.time() - loop_start
         time.sleep(max(0, 1.0 - elapsed))
 
-def monitor_single_market(timeframe, market_info):
+def parse_end_dt(market_info):
     """
-    Цикл моніторингу одного ринку.
+    Час закінчення ринку (UTC). Якщо не вдається розібрати - через годину.
     """
     try:
-        end_dt = datetime.fromisoformat(market_info['end_date'].replace('Z', '+00:00'))
+        return datetime.fromisoformat(market_info['end_date'].replace('Z', '+00:00'))
     except:
-        end_dt = datetime.now(timezone.utc) + timedelta(hours=1)
-        
-    session_dir = session_manager.get_session_dir(end_dt)
-    market_dir = os.path.join(session_dir, f"market_{timeframe}")
-    file_path = init_market_file(market_dir, market_info, timeframe)
+        return datetime.now(timezone.utc) + timedelta(hours=1)
+
+def parse_open_ts(market_info, end_dt):
+    """
+    Час відкриття ринку (epoch): кінець мінус тривалість таймфрейму,
+    інакше startDate події.
+    """
+    duration = TIMEFRAME_SECONDS.get(market_info.get('timeframe'))
+    if duration:
+        return end_dt.timestamp() - duration
+    try:
+        return datetime.fromisoformat(market_info['start_date'].replace('Z', '+00:00')).timestamp()
+    except:
+        return None
+
+def monitor_single_market(label, market_info, session_dir=None, resume=None, on_progress=None, features=False,
+                          stop_event=None):
+    """
+    Цикл моніторингу одного ринку.
+    label - мітка ринку (напр. 'btc_15m'), використовується в назвах папок і файлів.
+    session_dir - папка сесії від супервізора; якщо не задана, визначається локально.
+    resume - збережений стан ({"file_path", "cursor"}) для продовження запису після рестарту.
+    on_progress - викликається не частіше ніж раз на CHECKPOINT_INTERVAL з поточним станом.
+    features - рахувати похідні ознаки в features_<label>.csv поруч із файлом ринку.
+    stop_event - threading.Event для дострокової зупинки (завершення воркера).
+    """
+    end_dt = parse_end_dt(market_info)
     
-    print(f"✅ [{timeframe}] Старт: {market_info['title']} (End: {end_dt})")
+    backfill_from = None
+    if resume and resume.get('file_path') and os.path.exists(resume['file_path']):
+        file_path = resume['file_path']
+        cursors = [c for c in (resume.get('cursor'), read_last_timestamp(file_path)) if c]
+        if cursors:
+            backfill_from = max(cursors)
+        print(f"♻️  [{label}] Продовження: {market_info['title']} (End: {end_dt})")
+    else:
+        if session_dir is None:
+            session_dir = session_manager.session_dir_for(end_dt)
+        market_dir = os.path.join(session_dir, f"market_{label}")
+        os.makedirs(market_dir, exist_ok=True)
+        file_path = init_market_file(market_dir, market_info, label)
+        print(f"✅ [{label}] Старт: {market_info['title']} (End: {end_dt})")
     
     yes_id = market_info['yes_id']
     no_id = market_info['no_id']
     condition_id = market_info['condition_id']
     
+    # Стадія ознак необов'язкова: її помилки не повинні зупиняти запис сирих даних
+    feature_stage = None
+    if features:
+        try:
+            feature_stage = FeatureStage(yes_id, no_id, FEATURE_WINDOW)
+            feature_stage.init_file(os.path.dirname(file_path), market_info, label)
+            open_ts = parse_open_ts(market_info, end_dt)
+            btc_feed.start()
+        except Exception as e:
+            print(f"❌ [{label}] Стадію ознак вимкнено: {e}")
+            feature_stage = None
+    
     last_loop_time = time.time() - 1.0
+    last_progress_time = 0.0
+    backfill_empty_retries = 0
+    backfill_ticks = 0
+    # Рядки, записані під час очікування дозапису (в порядку часу)
+    pending_rows = []
     executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
     
     try:
@@ -281,19 +549,72 @@ def monitor_single_market(timeframe, market_info):
             now = datetime.now(timezone.utc)
             
             if now >= end_dt:
-                print(f"🏁 [{timeframe}] Завершено: {market_info['title']}")
+                if pending_rows:
+                    # Після закриття ринок не відновлюється, тож буфер записуємо без дозапису
+                    print(f"⚠️  [{label}] Ринок закрився до завершення дозапису.")
+                    with open(file_path, 'a', newline='') as f:
+                        csv.writer(f).writerows(pending_rows)
+                print(f"🏁 [{label}] Завершено: {market_info['title']}")
+                break
+            if stop_event is not None and stop_event.is_set():
+                print(f"🛑 [{label}] Зупинено: {market_info['title']}")
                 break
                 
-            timestamp = now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+            timestamp = now.strftime(TIMESTAMP_FORMAT)[:-3]
+            trades_limit = BACKFILL_TRADES_LIMIT if backfill_from is not None else 50
             
             future_yes_book = executor.submit(fetch_orderbook, yes_id)
             future_no_book = executor.submit(fetch_orderbook, no_id)
-            future_trades = executor.submit(fetch_trades, condition_id)
+            future_trades = executor.submit(fetch_trades, condition_id, trades_limit)
             
             yes_book = future_yes_book.result()
             no_book = future_no_book.result()
             trades = future_trades.result()
             
+            if backfill_from is not None:
+                # Угоди до loop_start - 1 дописуються окремими рядками, решта - в поточний рядок.
+                # Поки угоди не отримано, дозапис лишається на наступний тік, а нові рядки
+                # буферизуються, щоб файл лишався впорядкованим за часом.
+                backfill_ticks += 1
+                backfill_until = loop_start - 1.0
+                gap = backfill_until - backfill_from
+                rows = None
+                if trades is None and backfill_ticks < BACKFILL_MAX_TICKS:
+                    print(f"⚠️  [{label}] Не вдалося отримати угоди для дозапису. Повтор на наступному тіку...")
+                elif not trades and gap > BACKFILL_EMPTY_GAP and backfill_empty_retries < BACKFILL_ATTEMPTS \
+                        and backfill_ticks < BACKFILL_MAX_TICKS:
+                    backfill_empty_retries += 1
+                    print(f"⚠️  [{label}] Порожня відповідь з угодами для дозапису (спроба {backfill_empty_retries}). Повтор...")
+                elif trades is None:
+                    print(f"⚠️  [{label}] Дозапис не вдався за {backfill_ticks} тіків. Угоди за {gap:.1f}с простою втрачено.")
+                    rows = []
+                else:
+                    rows = []
+                    if gap > 0:
+                        rows, complete = backfill_rows(trades, yes_id, no_id, backfill_from, backfill_until)
+                        print(f"⏪ [{label}] Дописано {len(rows)} рядків угод за {gap:.1f}с простою.")
+                        if not complete:
+                            print(f"⚠️  [{label}] Угоди за час простою можуть бути неповними (ліміт {BACKFILL_TRADES_LIMIT}).")
+                            
+                if rows is not None:
+                    # Зливаємо дописані рядки з буферизованими за часом (формат часу сортується як рядок)
+                    merged = sorted(rows + pending_rows, key=lambda r: r[0])
+                    if merged:
+                        with open(file_path, 'a', newline='') as f:
+                            csv.writer(f).writerows(merged)
+                    pending_rows = []
+                    last_loop_time = max(backfill_from, backfill_until)
+                    backfill_from = None
+                    # Одразу фіксуємо дозапис: інакше після збою в найближчі секунди
+                    # вікно дописалося б повторно
+                    if on_progress:
+                        on_progress({
+                            "file_path": file_path,
+                            "cursor": last_loop_time,
+                            "last_written": datetime.fromtimestamp(last_loop_time, timezone.utc).strftime(TIMESTAMP_FORMAT)[:-3]
+                        })
+                        last_progress_time = loop_start
+            
             yes_book_row = parse_book(yes_book)
             no_book_row = parse_book(no_book)
             
@@ -303,66 +624,402 @@ def monitor_single_market(timeframe, market_info):
             full_row = [timestamp, yes_last, yes_vol, yes_str] + yes_book_row + \
                        [no_last, no_vol, no_str] + no_book_row
                        
-            with open(file_path, 'a', newline='') as f:
-                csv.writer(f).writerow(full_row)
+            if backfill_from is not None:
+                # Не пишемо у файл до завершення дозапису. Якщо воркер зупиниться раніше,
+                # буфер втрачається, а вікно дозапишеться після наступного старту
+                pending_rows.append(full_row)
+            else:
+                with open(file_path, 'a', newline='') as f:
+                    csv.writer(f).writerow(full_row)
+                
+            if feature_stage:
+                try:
+                    btc_open = btc_feed.open_price(open_ts) if open_ts else None
+                    feature_stage.update(timestamp, loop_start, yes_book_row, no_book_row, trades,
+                                         btc_feed.latest(), btc_open)
+                except Exception as e:
+                    print(f"❌ [{label}] Помилка стадії ознак: {e}")
                 
             last_loop_time = loop_start
+            
+            # Під час очікування дозапису у файл нічого не пишеться, тож попередній чекпоінт лишається чинним
+            if on_progress and backfill_from is None and loop_start - last_progress_time >= CHECKPOINT_INTERVAL:
+                on_progress({
+                    "file_path": file_path,
+                    "cursor": last_loop_time,
+                    "last_written": timestamp
+                })
+                last_progress_time = loop_start
             elapsed = time.time() - loop_start
-            time.sleep(max(0, 1.0 - elapsed))
+            if stop_event is not None:
+                stop_event.wait(max(0, 1.0 - elapsed))
+            else:
+                time.sleep(max(0, 1.0 - elapsed))
             
     finally:
         executor.shutdown(wait=False)
 
-def monitor_lifecycle(timeframe):
-    print(f"🔄 [{timeframe}] Потік запущено.")
+def run_market(worker_id, label, market_info, session_dir, resume, results, features=False, stop_event=None):
+    """
+    Запускає моніторинг ринку в потоці воркера. Передає супервізору прогрес
+    для чекпоінтів і повідомляє про завершення.
+    """
+    market_id = market_info['market_id']
     
-    while True:
-        try:
-            all_markets = find_nearest_markets()
-            market_data = all_markets.get(timeframe)
+    def on_progress(progress):
+        results.put(("progress", worker_id, market_id, progress))
+        
+    try:
+        monitor_single_market(label, market_info, session_dir, resume, on_progress, features, stop_event)
+    except Exception as e:
+        print(f"❌ [W{worker_id}] [{label}] Помилка: {e}")
+    finally:
+        results.put(("done", worker_id, market_id, None))
+
+def worker_main(worker_id, tasks, results, features=False):
+    """
+    Процес-воркер: запускає по потоку на кожен ринок, призначений супервізором.
+    Завершується за сигналом None від супервізора або коли батьківський процес зник;
+    перед виходом зупиняє потоки ринків, щоб не лишати сиріт, які дописують у файли.
+    """
+    print(f"🚀 [W{worker_id}] Воркер запущено (PID {os.getpid()}).")
+    running = {}
+    stop_event = threading.Event()
+    parent = multiprocessing.parent_process()
+    
+    try:
+        while True:
+            try:
+                task = tasks.get(timeout=1)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    print(f"🛑 [W{worker_id}] Супервізор зник. Завершення...")
+                    break
+                continue
+            if task is None:
+                break
+                
+            label, info, session_dir, resume = task
             
-            if not market_data:
-                print(f"⏳ [{timeframe}] Ринок не знайдено. Чекаємо...")
-                time.sleep(5)
+            for market_id in [m for m, t in running.items() if not t.is_alive()]:
+                del running[market_id]
+            if info['market_id'] in running:
+                continue
+                
+            t = threading.Thread(
+                target=run_market,
+                args=(worker_id, label, info, session_dir, resume, results, features, stop_event),
+                daemon=True
+            )
+            t.start()
+            running[info['market_id']] = t
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        # Поточний тік може чекати на запити (таймаут 2с)
+        deadline = time.time() + WORKER_STOP_TIMEOUT
+        for t in running.values():
+            t.join(max(0, deadline - time.time()))
+
+class Supervisor:
+    """
+    Розподіляє вибрані ринки між пулом процесів-воркерів.
+    Нові ринки отримує найменш завантажений воркер; закриті ринки звільняють місце.
+    Воркери, що впали, перезапускаються з тими ж ринками.
+    Стан (сесія, ринки, курсори угод) періодично зберігається в STATE_FILE
+    і відновлюється при старті.
+    """
+    def __init__(self, specs, num_workers=WORKER_PROCESSES, features=FEATURES_ENABLED):
+        self.specs = specs
+        self.num_workers = num_workers
+        self.features = features
+        self.results = MP_CONTEXT.Queue()
+        self.workers = [None] * num_workers
+        self.tasks = [None] * num_workers
+        # market_id -> {"worker", "label", "info", "session_dir", "end_dt", "progress"}
+        self.assignments = {}
+        self.next_refresh_at = 0.0
+        self.next_checkpoint_at = 0.0
+        # Цикл супервізора і shutdown() з головного потоку працюють з тими ж даними
+        self.lock = threading.RLock()
+        self.stopped = False
+        
+    def start(self):
+        for idx in range(self.num_workers):
+            self._spawn_worker(idx)
+            
+    def _spawn_worker(self, idx):
+        tasks = MP_CONTEXT.Queue()
+        p = MP_CONTEXT.Process(
+            target=worker_main,
+            args=(idx, tasks, self.results, self.features),
+            name=f"monitor-worker-{idx}",
+            daemon=True
+        )
+        p.start()
+        self.workers[idx] = p
+        self.tasks[idx] = tasks
+        
+    def _check_workers(self):
+        for idx, p in enumerate(self.workers):
+            if p.is_alive():
+                continue
+            print(f"⚠️  [Supervisor] Воркер W{idx} зупинився (код {p.exitcode}). Перезапуск...")
+            self._spawn_worker(idx)
+            for a in self.assignments.values():
+                if a['worker'] == idx:
+                    self._dispatch(a)
+                    
+    def _dispatch(self, a):
+        self.tasks[a['worker']].put((a['label'], a['info'], a['session_dir'], a.get('progress')))
+        
+    def _drain_results(self):
+        while True:
+            try:
+                kind, worker_id, market_id, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            a = self.assignments.get(market_id)
+            if not a or a['worker'] != worker_id:
                 continue
+            if kind == "progress":
+                a['progress'] = payload
+            elif kind == "done":
+                del self.assignments[market_id]
                 
-            info = extract_ids(market_data)
+    def _least_loaded_worker(self):
+        load = [0] * self.num_workers
+        for a in self.assignments.values():
+            load[a['worker']] += 1
+        return load.index(min(load))
+        
+    def rebalance(self, selected):
+        """
+        Призначає нові вибрані ринки воркерам.
+        Ринок звільняє свою мітку лише після повідомлення "done": доки останній
+        тік попереднього ринку ще може писати у market_<label>.csv, наступний
+        ринок з тією ж міткою не запускається.
+        """
+        now = datetime.now(timezone.utc)
+        
+        # Запасний варіант, якщо "done" загубився: тік завершується за кілька секунд
+        stale = now - timedelta(seconds=ASSIGNMENT_GRACE)
+        for market_id in [m for m, a in self.assignments.items() if a['end_dt'] <= stale]:
+            del self.assignments[market_id]
             
-            if info['yes_id'] == "N/A" or info['no_id'] == "N/A":
-                print(f"⚠️ [{timeframe}] Некоректні ID. Пропуск...")
-                time.sleep(5)
+        busy_labels = {a['label'] for a in self.assignments.values()}
+        for label, info in selected.items():
+            if info['market_id'] in self.assignments or label in busy_labels:
                 continue
                 
-            monitor_single_market(timeframe, info)
+            end_dt = parse_end_dt(info)
+            session_dir = session_manager.session_dir_for(end_dt)
+            idx = self._least_loaded_worker()
             
-            print(f"🔄 [{timeframe}] Пошук наступного ринку...")
-            time.sleep(1)
+            a = {
+                "worker": idx,
+                "label": label,
+                "info": info,
+                "session_dir": session_dir,
+                "end_dt": end_dt,
+                "progress": None
+            }
+            self.assignments[info['market_id']] = a
+            busy_labels.add(label)
+            self._dispatch(a)
+            print(f"📌 [Supervisor] {label} -> W{idx}: {info['title']}")
             
+    def save_checkpoint(self):
+        """
+        Атомарно зберігає стан в STATE_FILE.
+        """
+        state = {
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "session": session_manager.to_state(),
+            "markets": [
+                {
+                    "worker": a['worker'],
+                    "label": a['label'],
+                    "info": a['info'],
+                    "session_dir": a['session_dir'],
+                    "end_dt": a['end_dt'].isoformat(),
+                    "progress": a['progress']
+                }
+                for a in self.assignments.values()
+            ]
+        }
+        os.makedirs(BASE_DATA_DIR, exist_ok=True)
+        tmp_path = STATE_FILE + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, STATE_FILE)
+        
+    def restore(self):
+        """
+        Відновлює сесію та ринки, що ще не закрились, і одразу роздає їх воркерам,
+        не чекаючи запиту до Gamma API. Викликати після start().
+        """
+        if not os.path.exists(STATE_FILE):
+            return
+        try:
+            with open(STATE_FILE, 'r') as f:
+                state = json.load(f)
         except Exception as e:
-            print(f"❌ [{timeframe}] Помилка: {e}")
-            time.sleep(5)
+            print(f"⚠️  [Supervisor] Не вдалося прочитати стан {STATE_FILE}: {e}")
+            return
+            
+        if not isinstance(state, dict):
+            print(f"⚠️  [Supervisor] Невідомий формат стану {STATE_FILE}. Старт з нуля.")
+            return
+            
+        if state.get('session'):
+            try:
+                session_manager.restore(state['session'])
+            except Exception as e:
+                print(f"⚠️  [Supervisor] Некоректна сесія в стані: {e}")
+                
+        now = datetime.now(timezone.utc)
+        markets = state.get('markets')
+        for m in markets if isinstance(markets, list) else []:
+            try:
+                a = self._restored_assignment(m)
+            except Exception as e:
+                print(f"⚠️  [Supervisor] Пропуск некоректного ринку в стані: {e}")
+                continue
+            if a['end_dt'] <= now:
+                continue
+            self.assignments[a['info']['market_id']] = a
+            self._dispatch(a)
+            print(f"♻️  [Supervisor] {a['label']} -> W{a['worker']}: {a['info']['title']}")
+            
+    def _restored_assignment(self, m):
+        """
+        Перевіряє запис ринку зі стану і будує з нього призначення.
+        Кидає KeyError/ValueError/TypeError для некоректних записів.
+        """
+        info = m['info']
+        for key in ("title", "market_id", "condition_id", "yes_id", "no_id", "end_date"):
+            if key not in info:
+                raise KeyError(f"info.{key}")
+        end_dt = datetime.fromisoformat(m['end_dt'])
+        if end_dt.tzinfo is None:
+            raise ValueError(f"end_dt без часової зони: {m['end_dt']}")
+        progress = m.get('progress')
+        if progress is not None and not isinstance(progress, dict):
+            raise TypeError("progress має бути об'єктом")
+            
+        worker = m.get('worker')
+        if not isinstance(worker, int) or not 0 <= worker < self.num_workers:
+            worker = self._least_loaded_worker()
+        return {
+            "worker": worker,
+            "label": str(m['label']),
+            "info": info,
+            "session_dir": m['session_dir'],
+            "end_dt": end_dt,
+            "progress": progress
+        }
+        
+    def next_refresh_delay(self):
+        """
+        Чекаємо до найближчого закриття ринку, але не довше REFRESH_INTERVAL.
+        """
+        now = datetime.now(timezone.utc)
+        delay = REFRESH_INTERVAL
+        for a in self.assignments.values():
+            delay = min(delay, (a['end_dt'] - now).total_seconds() + 1)
+        return max(1.0, delay)
+        
+    def run(self):
+        """
+        Основний цикл супервізора. Воркери мають бути запущені через start().
+        """
+        while not self.stopped:
+            try:
+                selected = None
+                if time.time() >= self.next_refresh_at:
+                    # Запит до Gamma - поза lock, щоб не блокувати shutdown()
+                    selected = select_markets(self.specs)
+                    
+                with self.lock:
+                    if self.stopped:
+                        break
+                    self._drain_results()
+                    self._check_workers()
+                    
+                    if selected is not None:
+                        self.rebalance(selected)
+                        self.next_refresh_at = time.time() + self.next_refresh_delay()
+                        
+                    if time.time() >= self.next_checkpoint_at:
+                        self.save_checkpoint()
+                        self.next_checkpoint_at = time.time() + CHECKPOINT_INTERVAL
+            except Exception as e:
+                print(f"❌ [Supervisor] Помилка: {e}")
+                self.next_refresh_at = time.time() + 5
+            time.sleep(1)
+            
+    def shutdown(self):
+        """
+        Зупиняє воркерів (спершу м'яко, потім terminate) і зберігає фінальний чекпоінт.
+        """
+        with self.lock:
+            self.stopped = True
+            for tasks in self.tasks:
+                if tasks is not None:
+                    tasks.put(None)
+            deadline = time.time() + WORKER_STOP_TIMEOUT + 1
+            for p in self.workers:
+                if p is not None:
+                    p.join(max(0, deadline - time.time()))
+            for p in self.workers:
+                if p is not None and p.is_alive():
+                    p.terminate()
+                    p.join(1)
+            self._drain_results()
+            self.save_checkpoint()
+        print("💾 [Supervisor] Стан збережено.")
 
 def main():
+    arg_parser = argparse.ArgumentParser(description="Polymarket markets monitor")
+    arg_parser.add_argument("--specs", help="JSON файл зі специфікаціями вибору ринків")
+    arg_parser.add_argument("--workers", type=int, default=WORKER_PROCESSES, help="Кількість процесів-воркерів")
+    arg_parser.add_argument("--fresh", action="store_true", help="Не відновлювати збережений стан")
+    arg_parser.add_argument("--features", action="store_true", default=FEATURES_ENABLED, help="Рахувати похідні ознаки (features_<label>.csv)")
+    args = arg_parser.parse_args()
+    
+    specs = load_market_specs(args.specs)
+    
     print("🚀 Запуск системи моніторингу ринків...")
+    print(f"📋 Специфікації: {', '.join(spec['name'] for spec in specs)} | Воркерів: {args.workers}")
+    
+    # SIGTERM (kill, деплой) завершує процес так само, як Ctrl+C:
+    # воркери зупиняються і зберігається фінальний чекпоінт
+    def handle_sigterm(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
     
-    threads = []
+    supervisor = Supervisor(specs, args.workers, args.features)
+    supervisor.start()
+    if not args.fresh:
+        supervisor.restore()
     
     t_btc = threading.Thread(target=monitor_btc, daemon=True)
     t_btc.start()
-    threads.append(t_btc)
     
-    for tf in ['15m', '1h', '4h']:
-        t = threading.Thread(target=monitor_lifecycle, args=(tf,), daemon=True)
-        t.start()
-        threads.append(t)
+    t_supervisor = threading.Thread(target=supervisor.run, daemon=True)
+    t_supervisor.start()
         
     print("\n✅ Всі потоки активні. Ctrl+C для виходу.\n")
     
     try:
         while True:
             time.sleep(1)
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         print("\n🛑 Зупинка...")
+    finally:
+        supervisor.shutdown()
 
 if __name__ == "__main__":
     main()